@@ -2,118 +2,228 @@
 # Modified and deployed by Koda Khan
 # 07/05/2025
 
+import asyncio
+import functools
+import logging
 import os
+import pickle
 import re
+from collections.abc import Iterable
 import discord
 from discord.ext import commands
 from discord import app_commands
 
+log = logging.getLogger(__name__)
+
 # --- Configuration ---
 LOCAL_FILE_PATH = "catechism.txt"
+INDEX_SNAPSHOT_PATH = "catechism.pkl"
+# Snapshots older than catechism.txt or this script are rebuilt, so code changes invalidate them
+# automatically; bump this only when the snapshot file format itself changes.
+INDEX_SNAPSHOT_VERSION = 4
+# Discord embed descriptions max out at 4096 characters; leave some room for formatting
+QUOTE_MAX_LENGTH = 4000
+
+# --- Precompiled regex patterns ---
+# These stay on the standard library `re`: _CLEAN_RE relies on a lookahead that RE2 cannot express,
+# and it only runs over the bundled text while building the index. The only pattern applied to user
+# messages, _CCC_RE, has no nested or overlapping quantifiers, so it cannot backtrack catastrophically.
+_WS_RE = re.compile(r'\s+')
+# Bible verse references ("Book Chapter:Verse", "1 Book Chapter:Verse", "Book Chapter:Verse-Verse"),
+# years, and standalone numbers, tried in that order at each position. A number followed by
+# "." or ":" and a digit is kept unless those digits are a year, e.g. "(647 .1405)" drops the 647.
+# Supported behavior (identical to the old placeholder pipeline on the bundled catechism.txt):
+#   "(647 .1405)"    -> "(.1405)"
+#   "Rom 5:29, 1994" -> "Rom 5:29, 1994"
+# Known divergences from that pipeline on other input:
+#   "4 Rom 6:17"          -> "Rom 6:17"           (was "4 Rom 6:17")
+#   "see 12 .1 Cor 3:16"  -> "see 12 .1 Cor 3:16" (was "see .1 Cor 3:16")
+#   "5-7 Cor 3:16"        -> "- Cor 3:16"         (was "-7 Cor 3:16")
+_CLEAN_RE = re.compile(
+    r'(?P<bible>\b[1-3]?\s*[A-Za-z]+\s+\d+:\d+(?:-\d+)?(?:,\s*\d+(?:-\d+)?)*\b)'
+    r'|(?P<year>\b(?:1[0-9]{3}|20[0-9]{2})\b)'
+    r'|(?P<num>\b\d+\b(?!\s*[:.](?!(?:1[0-9]{3}|20[0-9]{2})\b)\d))'
+)
+_CLOSE_PAREN_RE = re.compile(r'\s+\)')
+_OPEN_PAREN_RE = re.compile(r'\(\s+')
+_CCC_RE = re.compile(r"ccc\.?\s*(\d+)", re.IGNORECASE)
+
+# Citation styles the bot recognizes, keyed by the lowercase literal every match must contain.
+# New styles (e.g. "cic", "denz") only need an entry here; their regex runs only when the literal is present.
+_CITATION_PATTERNS: dict[str, re.Pattern] = {
+    'ccc': _CCC_RE,
+}
+
+# --- Global variable to cache Catechism paragraphs (loaded from local file) ---
+CATECHISM_PARAGRAPHS: dict[str, str] = {}
+
+# --- Paragraph Index Functions ---
+def build_catechism_index(lines: Iterable[str]) -> dict[str, str]:
+    """
+    Splits the Catechism text into paragraphs keyed by their number, one line at a time.
+    Each paragraph is cleaned and truncated once here so lookups need no further processing.
+    """
+    # A paragraph starts at a line whose first token is a number followed by whitespace,
+    # and runs until the next line that starts with a number, or the end of the document.
+    # The first occurrence of a number with non-empty cleaned text wins. A line carrying only
+    # footnote digits after the number (e.g. "1887 1") is a cross-reference stub: it ends at the
+    # end of that line, so a heading below it can't be mistaken for the paragraph body.
+    paragraphs = {}
+    quote_id = None
+    buffer = []
 
-# --- Global variable to cache Catechism text (loaded from local file) ---
-CACHED_CATECHISM_CONTENT = None
+    def flush():
+        if quote_id is None or quote_id in paragraphs:
+            return
+        # Clean the text
+        cleaned_text = clean_catechism_text(''.join(buffer))
+        if cleaned_text:
+            # Store the quote exactly as it will be displayed, truncating it if it's too long for an embed
+            if len(cleaned_text) > QUOTE_MAX_LENGTH:
+                cleaned_text = cleaned_text[:QUOTE_MAX_LENGTH] + "...\n(Quote too long, truncated.)"
+            paragraphs[quote_id] = cleaned_text
+
+    for line in lines:
+        stripped = line.lstrip()
+        if not stripped[:1].isdecimal():
+            if quote_id is not None:
+                buffer.append(line)
+            continue
+
+        flush()
+        buffer.clear()
+        first_token, *rest = stripped.split(None, 1)
+        quote_id = first_token if first_token.isdecimal() else None
+        if quote_id is not None:
+            buffer.extend(rest)
+            if rest and all(token.isdecimal() for token in rest[0].split()):
+                flush()
+                quote_id = None
 
-# --- Offline Text Retrieval Function ---
-def get_catechism_text_offline(file_path: str = LOCAL_FILE_PATH) -> str | None:
+    flush()
+    return paragraphs
+
+def load_catechism_index_offline(file_path: str = LOCAL_FILE_PATH) -> dict[str, str] | None:
     """
-    Reads the Catechism text content from a local file.
+    Builds the paragraph index by streaming the Catechism text from a local file.
     """
     if not os.path.exists(file_path):
-        print(f"Local file '{file_path}' not found.")
+        log.error("Local file '%s' not found.", file_path)
         return None
     
     try:
+        # Stream in text mode rather than reading and decoding the whole file at once,
+        # so the raw text is never held in memory alongside the index.
         with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        print(f"Successfully loaded Catechism text from: {file_path}")
-        return content
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            paragraphs = build_catechism_index(f)
+        log.info("Successfully loaded Catechism text from: %s", file_path)
+        return paragraphs
     except IOError as e:
-        print(f"Error reading local file '{file_path}': {e}")
+        log.error("Error reading local file '%s': %s", file_path, e)
+        return None
+    except UnicodeDecodeError as e:
+        log.error("Local file '%s' is not valid UTF-8: %s", file_path, e)
         return None
     except Exception as e:
-        print(f"An unexpected error occurred while reading the file: {e}")
+        log.exception("An unexpected error occurred while reading the file: %s", e)
         return None
 
-# --- Quote Search Function ---
-def find_catechism_quote(text_content: str, quote_id: str) -> str | None:
+def load_catechism_index_snapshot(snapshot_path: str = INDEX_SNAPSHOT_PATH,
+                                  file_path: str = LOCAL_FILE_PATH) -> dict[str, str] | None:
     """
-    Searches for a specific Catechism quote within the provided text content.
-    Handles cleaning of extra spaces and filters out random numbers.
+    Loads a previously built paragraph index, if it is at least as new as the text file
+    and the code that built it.
     """
-    # Refined regex to find the paragraph associated with the quote_id.
-    # It looks for the number at the start of a line, followed by any whitespace/newlines,
-    # then captures everything until the next line that starts with a number, or the end of the document.
-    paragraph_start_pattern = r"(?:\n|^)\s*" + re.escape(quote_id) + r"[\s\n]+(.+?)(?=\n\s*\d+|\Z)"
-    
-    paragraph_match = re.search(paragraph_start_pattern, text_content, re.DOTALL)
+    try:
+        source_mtime = max(os.path.getmtime(file_path), os.path.getmtime(__file__))
+        if os.path.getmtime(snapshot_path) < source_mtime:
+            return None
+        with open(snapshot_path, 'rb') as f:
+            version, paragraphs = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.warning("Ignoring unreadable index snapshot '%s': %s", snapshot_path, e)
+        return None
 
-    if paragraph_match:
-        found_text = paragraph_match.group(1).strip()
-        
-        # Clean the text
-        cleaned_text = clean_catechism_text(found_text)
-        return cleaned_text
-    return None
+    if version != INDEX_SNAPSHOT_VERSION:
+        return None
+    log.info("Loaded Catechism paragraph index from: %s", snapshot_path)
+    return paragraphs
+
+def save_catechism_index_snapshot(paragraphs: dict[str, str], snapshot_path: str = INDEX_SNAPSHOT_PATH) -> None:
+    """
+    Saves the paragraph index so later restarts can skip parsing and cleaning the text file.
+    """
+    tmp_path = snapshot_path + ".tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((INDEX_SNAPSHOT_VERSION, paragraphs), f, protocol=5)
+        os.replace(tmp_path, snapshot_path)
+    except Exception as e:
+        log.warning("Failed to save index snapshot '%s': %s", snapshot_path, e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def find_catechism_quote(quote_id: str) -> str:
+    """
+    Looks up a specific Catechism quote in the prebuilt paragraph index.
+    Returns an empty string if there is no paragraph with that number.
+    """
+    return CATECHISM_PARAGRAPHS.get(quote_id, "")
+
+def _keep_protected_ref(match: re.Match) -> str:
+    """
+    Substitution callback for _CLEAN_RE: drops standalone numbers, keeps Bible and year references.
+    """
+    return '' if match.lastgroup == 'num' else match.group(0)
 
 def clean_catechism_text(text: str) -> str:
     """
     Improved cleaning function that preserves Bible verse references and handles parentheses correctly.
     """
     # Remove extra spaces between words (multiple spaces become single space)
-    text = re.sub(r'\s+', ' ', text)
+    text = _WS_RE.sub(' ', text)
     
     # Remove standalone numbers that are NOT part of:
     # - Bible verse references (like "Rom 5:29", "1 Cor 3:16", "Mt 5:3-12")
     # - Years (like "1994", "2000")
     # - Other legitimate number contexts
-    
-    # First, protect Bible verse references by temporarily replacing them
-    # Common patterns: "Book Chapter:Verse", "1 Book Chapter:Verse", "Book Chapter:Verse-Verse"
-    bible_refs = []
-    bible_pattern = r'\b(?:[1-3]?\s*[A-Za-z]+\s+\d+:\d+(?:-\d+)?(?:,\s*\d+(?:-\d+)?)*)\b'
-    
-    def replace_bible_ref(match):
-        bible_refs.append(match.group(0))
-        return f"__BIBLE_REF_{len(bible_refs)-1}__"
-    
-    text = re.sub(bible_pattern, replace_bible_ref, text)
-    
-    # Also protect years (4-digit numbers that could be years)
-    year_refs = []
-    year_pattern = r'\b(?:1[0-9]{3}|20[0-9]{2})\b'
-    
-    def replace_year_ref(match):
-        year_refs.append(match.group(0))
-        return f"__YEAR_REF_{len(year_refs)-1}__"
-    
-    text = re.sub(year_pattern, replace_year_ref, text)
-    
-    # Now remove standalone numbers that are likely section references or footnote numbers
-    # This targets isolated numbers that appear alone, not as part of other text
-    text = re.sub(r'\b\d+\b(?!\s*[:.]\d)', '', text)
+    # A single scan recognizes all three; only standalone numbers (likely section
+    # references or footnote numbers) are dropped, everything else is kept as-is.
+    text = _CLEAN_RE.sub(_keep_protected_ref, text)
     
     # Remove extra spaces that might be left after removing numbers
-    text = re.sub(r'\s+', ' ', text)
+    text = _WS_RE.sub(' ', text)
     
     # Fix parentheses spacing issues - remove spaces before closing parentheses
-    text = re.sub(r'\s+\)', ')', text)
+    text = _CLOSE_PAREN_RE.sub(')', text)
     # Remove spaces after opening parentheses
-    text = re.sub(r'\(\s+', '(', text)
-    
-    # Restore Bible verse references
-    for i, bible_ref in enumerate(bible_refs):
-        text = text.replace(f"__BIBLE_REF_{i}__", bible_ref)
-    
-    # Restore year references
-    for i, year_ref in enumerate(year_refs):
-        text = text.replace(f"__YEAR_REF_{i}__", year_ref)
+    text = _OPEN_PAREN_RE.sub('(', text)
     
     # Remove leading/trailing whitespace
     text = text.strip()
     
     return text
 
+# --- Citation Detection ---
+def find_citation(content: str) -> tuple[str, re.Match] | None:
+    """
+    Finds the first supported citation in a message, returning its style and regex match.
+    The lowercased content is scanned for each style's literal before any regex is run.
+    """
+    lowered = content.lower()
+    for literal, pattern in _CITATION_PATTERNS.items():
+        if literal in lowered:
+            match = pattern.search(content)
+            if match:
+                return literal, match
+    return None
+
 # --- Discord Bot Setup ---
 # Replace this line:
 # bot.run('your_actual_bot_token_here')
@@ -131,38 +241,54 @@ async def on_ready():
     Event that fires when the bot successfully connects to Discord.
     Loads the Catechism text from the local file and syncs slash commands.
     """
-    print(f'Logged in as {bot.user.name} ({bot.user.id})')
-    print('------')
-    print("Bot invite URL with recommended permissions:")
-    print(f"https://discord.com/api/oauth2/authorize?client_id={bot.user.id}&permissions=2147486720&scope=bot%20applications.commands")
-    print("Loading Catechism text from local file...")
-    global CACHED_CATECHISM_CONTENT
+    log.info("Logged in as %s (%s)", bot.user.name, bot.user.id)
+    log.info(
+        "Bot invite URL with recommended permissions: "
+        "https://discord.com/api/oauth2/authorize?client_id=%s&permissions=2147486720&scope=bot%%20applications.commands",
+        bot.user.id
+    )
+    log.info("Loading Catechism text from local file...")
+    global CATECHISM_PARAGRAPHS
 
     if not os.path.exists(LOCAL_FILE_PATH):
-        print(f"ERROR: Local file '{LOCAL_FILE_PATH}' not found. Please ensure the file exists in the same directory as this script.")
-        print("Bot will not be able to find quotes without this file.")
+        log.error("Local file '%s' not found. Please ensure the file exists in the same directory as this script.", LOCAL_FILE_PATH)
+        log.error("Bot will not be able to find quotes without this file.")
         return
     
-    CACHED_CATECHISM_CONTENT = get_catechism_text_offline()
-    if CACHED_CATECHISM_CONTENT:
-        print("Catechism text loaded successfully from local file.")
+    snapshot = load_catechism_index_snapshot()
+    if snapshot:
+        CATECHISM_PARAGRAPHS = snapshot
+        log.info("Indexed %d Catechism paragraphs.", len(CATECHISM_PARAGRAPHS))
     else:
-        print("Failed to load Catechism text from local file. Bot may not function correctly.")
+        paragraphs = load_catechism_index_offline()
+        if paragraphs:
+            CATECHISM_PARAGRAPHS = paragraphs
+            log.info("Indexed %d Catechism paragraphs.", len(CATECHISM_PARAGRAPHS))
+            save_catechism_index_snapshot(CATECHISM_PARAGRAPHS)
+        else:
+            log.error("Failed to load Catechism text from local file. Bot may not function correctly.")
+    # Embeds cached from a previous load may hold stale text
+    _build_embed.cache_clear()
     
-    # Sync slash commands globally and to current guilds
+    # Sync slash commands globally (propagates to every guild, may take up to an hour)
     try:
         synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} slash command(s) globally")
+        log.info("Synced %d slash command(s) globally", len(synced))
         
-        # Also sync to all guilds the bot is in for immediate updates
-        for guild in bot.guilds:
-            try:
-                guild_synced = await bot.tree.sync(guild=guild)
-                print(f"Synced {len(guild_synced)} slash command(s) to {guild.name}")
-            except Exception as guild_e:
-                print(f"Failed to sync to guild {guild.name}: {guild_e}")
+        # Set DEV_SYNC to also sync to all guilds the bot is in for immediate updates during development
+        if os.getenv('DEV_SYNC'):
+            guilds = list(bot.guilds)
+            results = await asyncio.gather(
+                *(bot.tree.sync(guild=guild) for guild in guilds),
+                return_exceptions=True
+            )
+            for guild, guild_synced in zip(guilds, results):
+                if isinstance(guild_synced, Exception):
+                    log.warning("Failed to sync to guild %s: %s", guild.name, guild_synced)
+                else:
+                    log.info("Synced %d slash command(s) to %s", len(guild_synced), guild.name)
     except Exception as e:
-        print(f"Failed to sync slash commands: {e}")
+        log.error("Failed to sync slash commands: %s", e)
 
 @bot.tree.command(name='ping', description='Test bot responsiveness and latency')
 async def ping_slash(interaction: discord.Interaction):
@@ -172,49 +298,56 @@ async def ping_slash(interaction: discord.Interaction):
     latency = round(bot.latency * 1000)  # Convert to milliseconds
     await interaction.response.send_message(f'Pong! 🏓 Latency: {latency}ms')
 
+@functools.lru_cache(maxsize=256)
+def _build_embed(quote_id: str, found_quote: str) -> discord.Embed:
+    """
+    Builds the reply embed for an existing Catechism quote.
+    Results are cached since popular paragraphs are requested over and over; only call this for
+    quotes that exist so unknown IDs can't evict them. Callers must not modify the returned embed.
+    Call _build_embed.cache_clear() whenever the index is reloaded.
+    """
+    # Create a rich embed with Vatican colors
+    embed = discord.Embed(
+        title=f"📖 CCC {quote_id}",
+        description=found_quote,
+        color=0xFFD700  # Vatican yellow/gold hex color
+    )
+    
+    # Add footer with bot info
+    embed.set_footer(
+        text="Catechism Bot • Made by Louiepolk",
+        icon_url="https://cdn.discordapp.com/attachments/1234567890/example.png"  # Optional: Add bot avatar
+    )
+    return embed
+
 @bot.event
 async def on_message(message):
     """
     Event that fires when a message is sent in any channel the bot can see.
     Checks for "CCC [number]" patterns and responds automatically.
     """
-    # Ignore messages from the bot itself to prevent infinite loops
-    if message.author == bot.user:
+    # Ignore messages from bots (including this one) to prevent infinite loops
+    # and skip webhook/bot cross-talk before touching the message content at all
+    if message.author.bot:
         return
 
-    # Regex to find "CCC" followed by an optional dot and a number
-    # It's case-insensitive and captures the number.
-    match = re.search(r"[Cc][Cc][Cc]\.?\s*(\d+)", message.content)
+    # Look for "CCC" followed by an optional dot and a number (case-insensitive).
+    # Ordinary chatter is rejected by a literal check without reaching the regex engine.
+    citation = find_citation(message.content)
 
-    if match:
+    if citation:
+        _, match = citation
         quote_id = match.group(1) # Extract the captured number
-        print(f"Detected CCC quote request: {quote_id}")  # Debug line
+        log.debug("Detected CCC quote request: %s", quote_id)
 
-        if not CACHED_CATECHISM_CONTENT:
+        if not CATECHISM_PARAGRAPHS:
             await message.channel.send("Sorry, the Catechism text is not loaded. Please ensure the 'catechism.txt' file exists.")
             return
 
-        found_quote = find_catechism_quote(CACHED_CATECHISM_CONTENT, quote_id)
+        found_quote = find_catechism_quote(quote_id)
 
         if found_quote:
-            # Truncate the quote if it's too long for a Discord embed (max 4096 characters for description).
-            if len(found_quote) > 4000: # Leave some room for formatting
-                found_quote = found_quote[:4000] + "...\n(Quote too long, truncated.)"
-            
-            # Create a rich embed with Vatican colors
-            embed = discord.Embed(
-                title=f"📖 CCC {quote_id}",
-                description=found_quote,
-                color=0xFFD700  # Vatican yellow/gold hex color
-            )
-            
-            # Add footer with bot info
-            embed.set_footer(
-                text="Catechism Bot • Made by Louiepolk",
-                icon_url="https://cdn.discordapp.com/attachments/1234567890/example.png"  # Optional: Add bot avatar
-            )
-            
-            await message.channel.send(embed=embed)
+            await message.channel.send(embed=_build_embed(quote_id, found_quote))
         else:
             await message.channel.send(f"Could not find Catechism quote with ID: `{quote_id}`. Please check the number.")
     
@@ -223,9 +356,11 @@ async def on_message(message):
     await bot.process_commands(message)
 
 if __name__ == "__main__":
+    # Configure logging up front so messages outside bot.run() are formatted the same way
+    discord.utils.setup_logging()
     try:
-        bot.run(DISCORD_BOT_TOKEN)
+        bot.run(DISCORD_BOT_TOKEN, log_handler=None)
     except discord.LoginFailure:
-        print("ERROR: Invalid Discord bot token. Please check your token.")
+        log.error("Invalid Discord bot token. Please check your token.")
     except Exception as e:
-        print(f"An error occurred while running the bot: {e}")
+        log.exception("An error occurred while running the bot: %s", e)